@@ -0,0 +1,230 @@
+from contextlib import contextmanager
+
+import torch
+
+from full_precision_layers import DeepCapsBlock
+
+# Histogram of the absolute values of the activations, accumulated on a log2 scale: number of
+# bins and exponent range. The log spacing gives resolution where the activations actually live
+# (most are well below 1), and the upper bound matches the clamping value used by the
+# quantization methods (2 ** 10)
+HISTOGRAM_BINS = 2048
+HISTOGRAM_MIN_EXP = -20
+HISTOGRAM_MAX_EXP = 10
+
+
+def save_max_values(model, filename):
+    """ Store the activation maxima collected on a model
+
+        The maxima are saved as the list of layer names plus the flat buffer tensor, instead of
+        a nested dictionary of Python floats: serializing a single tensor is much cheaper and
+        the zipfile format keeps the checkpoint compact.
+
+        Args:
+            model: pytorch model using the CharacterizationUtils mixin
+            filename: string with the destination file """
+    names = [name for name, module in model.characterization_registry]
+    max_buffer = model.reduced_max_buffer()
+    if max_buffer is None:
+        max_buffer = torch.zeros(len(names))
+    torch.save({'names': names, 'max_values': max_buffer.cpu()}, filename,
+               _use_new_zipfile_serialization=True)
+
+
+def freeze_batchnorm(model):
+    """ Freeze the Batch Normalization layers of a model before characterization
+
+        The layers are switched to evaluate mode, so they use the running statistics instead of
+        the batch statistics, and their parameters stop requiring gradients. This keeps the
+        collected maxima consistent with the statistics that the quantized model will use.
+
+        Args:
+            model: pytorch model """
+    for module in model.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            module.eval()
+            for p in module.parameters():
+                p.requires_grad_(False)
+
+
+def load_max_values(filename):
+    """ Load the activation maxima stored by save_max_values
+
+        Args:
+            filename: string with the file to load
+        Returns:
+            max_values: dictionary with the maximum absolute value of each monitored layer """
+    checkpoint = torch.load(filename, map_location='cpu')
+    return dict(zip(checkpoint['names'], checkpoint['max_values'].tolist()))
+
+
+class CharacterizationUtils:
+    """ Mixin that collects the maximum absolute values reached by the activations of a model
+
+        The maximum values are needed to size the integer part of the fixed-point representation
+        used by the Q-CapsNets framework, since the quantization methods only act on the
+        fractional part of the values.
+
+        Attributes:
+            characterize: bool that toggles the collection of the maximum values
+            max_values: dictionary with the maximum absolute value seen by each monitored layer
+        Methods:
+            init_characterization: initialize the structures used for the collection
+            update_max: update the maximum absolute value reached by the activations of a layer
+    """
+
+    characterize = False
+    collect_histograms = False
+
+    def init_characterization(self):
+        """ Initialize the structures used for the collection of the maximum values
+
+            The monitored layers are collected once in a registry and a forward hook is attached
+            to each of them, so the models do not need one hand-written update per layer.
+            The running maxima of all the layers are packed in a single 1-D tensor per device,
+            allocated on the device of the activations at the first update, so no transfer
+            happens until max_values is read. With multiple GPUs (DataParallel) each replica
+            accumulates into the buffer of its own device and the buffers are all-reduced with
+            a maximum when the values are read """
+        self.characterization_registry = []
+        for name, module in self.named_children():
+            if isinstance(module, DeepCapsBlock):
+                # container blocks are expanded so that each sub-layer is monitored individually
+                self.characterization_registry.extend(
+                    (name + '.' + sub_name, sub_module) for sub_name, sub_module in module.named_children())
+            else:
+                self.characterization_registry.append((name, module))
+        self._max_buffers = {}
+        self._hist_buffers = {}
+        for index, (name, module) in enumerate(self.characterization_registry):
+            module.register_forward_hook(self._characterization_hook(index))
+
+    @contextmanager
+    def characterization_enabled(self):
+        """ Context manager that enables the collection of the maximum values
+
+            Leaving the characterize flag set forever would make every later forward pass (e.g.
+            the ones issued by the Q-CapsNets search) keep updating the maxima needlessly. The
+            context manager enables the flag only for the wrapped code and always restores the
+            previous value on exit """
+        previous = self.characterize
+        self.characterize = True
+        try:
+            yield self
+        finally:
+            self.characterize = previous
+
+    def _characterization_hook(self, index):
+        """ Build the forward hook that updates the maximum values of a monitored layer
+
+            Args:
+                index: position of the monitored layer in the characterization registry
+            Returns:
+                hook: forward hook to be registered on the layer """
+        def hook(module, inputs, output):
+            if self.characterize:
+                self.update_max(output, index)
+                if self.collect_histograms:
+                    self.update_histogram(output, index)
+        return hook
+
+    def update_max(self, x, index):
+        """ Update the maximum absolute value reached by the activations of a layer
+
+            The maximum of the batch is computed with a single fused torch.amax reduction over
+            all the samples, instead of tracking the maximum of each sample at Python level.
+
+            Args:
+                x: activation Tensor of the monitored layer
+                index: position of the monitored layer in the characterization registry """
+        # the maxima are accumulated in FP32 even when the forward pass runs in FP16 autocast
+        batch_max = torch.amax(x.detach().float().abs())
+        max_buffer = self._max_buffers.get(x.device)
+        if max_buffer is None:
+            max_buffer = torch.zeros(len(self.characterization_registry), device=x.device)
+            self._max_buffers[x.device] = max_buffer
+        max_buffer[index] = torch.maximum(max_buffer[index], batch_max)
+
+    def update_histogram(self, x, index):
+        """ Accumulate the histogram of the absolute values of the activations of a layer
+
+            The histogram is computed over log2 of the absolute values, so the bins are
+            log-spaced and keep their resolution for the small activations that dominate the
+            distribution. It stays on the device of the activations, so the accumulation does
+            not add any device-to-host synchronization. Compared with the plain maximum, the
+            histogram allows a percentile-based scale that is robust to outlier activations.
+
+            Args:
+                x: activation Tensor of the monitored layer
+                index: position of the monitored layer in the characterization registry """
+        exponents = x.detach().float().abs().clamp_min(2.0 ** HISTOGRAM_MIN_EXP).log2()
+        batch_hist = torch.histc(exponents, bins=HISTOGRAM_BINS, min=HISTOGRAM_MIN_EXP, max=HISTOGRAM_MAX_EXP)
+        hist_buffer = self._hist_buffers.get(x.device)
+        if hist_buffer is None:
+            hist_buffer = torch.zeros(len(self.characterization_registry), HISTOGRAM_BINS, device=x.device)
+            self._hist_buffers[x.device] = hist_buffer
+        hist_buffer[index] += batch_hist
+
+    def reduced_max_buffer(self):
+        """ All-reduce the per-device maxima buffers with a maximum
+
+            Returns:
+                max_buffer: 1-D Tensor with the maxima of all the monitored layers, or None if
+                            no value has been collected yet """
+        if not self._max_buffers:
+            return None
+        buffers = list(self._max_buffers.values())
+        if len(buffers) == 1:
+            return buffers[0]
+        device = buffers[0].device
+        return torch.stack([b.to(device) for b in buffers]).amax(dim=0)
+
+    def reduced_hist_buffer(self):
+        """ All-reduce the per-device histogram buffers with a sum
+
+            Returns:
+                hist_buffer: 2-D Tensor with the histograms of all the monitored layers, or None
+                             if no histogram has been collected yet """
+        if not self._hist_buffers:
+            return None
+        buffers = list(self._hist_buffers.values())
+        if len(buffers) == 1:
+            return buffers[0]
+        device = buffers[0].device
+        return torch.stack([b.to(device) for b in buffers]).sum(dim=0)
+
+    def percentile_values(self, percentile=0.999):
+        """ Compute a percentile of the activations of each layer from the histograms
+
+            Args:
+                percentile: percentile of the distribution to compute (default = 0.999)
+            Returns:
+                percentile_values: dictionary with the percentile value of each monitored layer """
+        names = [name for name, module in self.characterization_registry]
+        hist_buffer = self.reduced_hist_buffer()
+        if hist_buffer is None:
+            return {name: 0.0 for name in names}
+        bin_width = (HISTOGRAM_MAX_EXP - HISTOGRAM_MIN_EXP) / HISTOGRAM_BINS
+        values = []
+        for index in range(len(names)):
+            hist = hist_buffer[index]
+            total = hist.sum()
+            if total == 0:
+                values.append(0.0)
+                continue
+            cdf = hist.cumsum(0) / total
+            bin_index = int((cdf >= percentile).nonzero()[0].item())
+            # upper edge of the bin, back from the log2 domain
+            values.append(2.0 ** (HISTOGRAM_MIN_EXP + (bin_index + 1) * bin_width))
+        return dict(zip(names, values))
+
+    @property
+    def max_values(self):
+        """ Dictionary with the maximum absolute value seen by each monitored layer
+
+            Materialized lazily with a single device-to-host transfer of the buffer tensor """
+        names = [name for name, module in self.characterization_registry]
+        max_buffer = self.reduced_max_buffer()
+        if max_buffer is None:
+            return {name: 0.0 for name in names}
+        return dict(zip(names, max_buffer.cpu().tolist()))
@@ -1,7 +1,8 @@
 from full_precision_layers import *
+from characterization import CharacterizationUtils
 
 
-class ShallowCapsNet(nn.Module):
+class ShallowCapsNet(nn.Module, CharacterizationUtils):
     """ CapsNet model as in Sabour et al. 2017
 
     Methods:
@@ -24,6 +25,8 @@ class ShallowCapsNet(nn.Module):
                                              kernel_size=9, stride=2, padding=0, iterations=1)
         self.digit = Capsules(ci=1152, ni=8, co=num_classes, no=dim_output_capsules, iterations=3)
 
+        self.init_characterization()
+
     def forward(self, x):
         """ forward method
             Args:
@@ -41,7 +44,7 @@ class ShallowCapsNet(nn.Module):
         return out_digit
 
 
-class DeepCaps(nn.Module):
+class DeepCaps(nn.Module, CharacterizationUtils):
     """ DeepCaps architecture
 
         Methods:
@@ -88,6 +91,8 @@ class DeepCaps(nn.Module):
 
         self.capsLayer = Capsules(ci=t, ni=8, co=num_classes, no=dim_output_capsules, iterations=3)
 
+        self.init_characterization()
+
     def forward(self, x):
         """ forward method
 
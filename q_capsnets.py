@@ -1,440 +1,619 @@
-import torch
-import copy
-import sys
-import numpy as np
-from utils import one_hot_encode, capsnet_testing_loss
-from torch.autograd import Variable
-from torch.backends import cudnn
-from quantization_methods import *
-from quantized_models import *
-
-
-def quantized_test(model, num_classes, data_loader, quantization_function, quantization_bits,
-                   quantization_bits_routing):
-    """ Function to test the accuracy of the quantized models
-
-        Args:
-            model: pytorch model
-            num_classes: number ot classes of the dataset
-            data_loader: data loader of the test dataset
-            quantization_function: quantization function of the quantization method to use
-            quantization_bits: list, quantization bits for the activations
-            quantization_bits_routing: list, quantization bits for the dynamic routing
-        Returns:
-            accuracy_percentage: accuracy of the quantized model expressed in percentage """
-    # Switch to evaluate mode
-    model.eval()
-
-    loss = 0
-    correct = 0
-
-    num_batches = len(data_loader)
-
-    for data, target in data_loader:
-        batch_size = data.size(0)
-        target_one_hot = one_hot_encode(target, length=num_classes)
-
-        if torch.cuda.device_count() > 0:  # if there are available GPUs, move data to the first visible
-            device = torch.device("cuda:0")
-            data = data.to(device)
-            target = target.to(device)
-            target_one_hot = target_one_hot.to(device)
-
-        # Output predictions
-        output = model(data, quantization_function, quantization_bits, quantization_bits_routing)
-
-        # Sum up batch loss
-        m_loss = \
-            capsnet_testing_loss(output, target_one_hot)
-        loss += m_loss.data
-
-        # Count number of correct predictions
-        # Compute the norm of the vector capsules
-        v_length = torch.sqrt((output ** 2).sum(dim=2))
-        assert v_length.size() == torch.Size([batch_size, num_classes])
-
-        # Find the index of the longest vector
-        _, max_index = v_length.max(dim=1)
-        assert max_index.size() == torch.Size([batch_size])
-
-        # vector with 1 where the model makes a correct prediction, 0 where false
-        correct_pred = torch.eq(target.cpu(), max_index.data.cpu())
-        correct += correct_pred.sum()
-
-    # Log test accuracies
-    num_test_data = len(data_loader.dataset)
-    accuracy_percentage = float(correct) * 100.0 / float(num_test_data)
-
-    return accuracy_percentage
-
-
-def qcapsnets(model, model_parameters, full_precision_filename, num_classes, data_loader, top_accuracy,
-              accuracy_tolerance, memory_budget, quantization_scheme):
-    """ Q-CapsNets framework - Quantization
-
-        Args:
-            model: string, name of the model
-            model_parameters: list, parameters to use for the instantiation of the model class
-            full_precision_filename: string, directory of the full-precision weights
-            num_classes: number of classes of the dataset
-            data_loader: data loader of the testing dataset
-            top_accuracy : maximum accuracy reached by the full_precision trained model (percentage)
-            accuracy_tolerance: tolerance of the quantized model accuracy with respect to the full precision accuracy.
-                                Provided in percentage
-            memory_budget: memory budget for the weights of the model. Provided in MB (MegaBytes)
-            quantization_scheme: quantization scheme to be used by the framework (string, e.g., "truncation)"
-        Returns:
-            void
-    """
-    print("==> Q-CapsNets Framework")
-    # instantiate the quantized model with the full-precision weights
-    model_quant_class = getattr(sys.modules[__name__], model)
-    model_quant_original = model_quant_class(*model_parameters)
-    model_quant_original.load_state_dict(torch.load(full_precision_filename))
-
-    # Move the model to GPU if available
-    if torch.cuda.device_count() > 0:
-        device = torch.device("cuda:0")
-        model_quant_original.to(device)
-        cudnn.benchmark = True
-
-    # create the quantization functions
-    possible_functions = globals().copy()
-    possible_functions.update(locals())
-    quantization_function_activations = possible_functions.get(quantization_scheme)
-    if not quantization_function_activations:
-        raise NotImplementedError("Quantization function %s not implemented" % quantization_scheme)
-    quantization_function_weights = possible_functions.get(quantization_scheme + "_inplace")
-    if not quantization_function_weights:
-        raise NotImplementedError("Quantization function %s not implemented (inplace version)" % quantization_scheme)
-
-    # compute the accuracy reduction available for each step
-    minimum_accuracy = top_accuracy - accuracy_tolerance / 100 * top_accuracy
-    acc_reduction = top_accuracy - minimum_accuracy
-    step1_reduction = 5 / 100 * acc_reduction
-    step1_min_acc = top_accuracy - step1_reduction
-
-    print("Full-precision accuracy: ", top_accuracy, "%")
-    print("Minimum quantized accuracy: ", minimum_accuracy, "%")
-    print("Memory budget: ", memory_budget, "MB")
-    print("Quantization method: ", quantization_scheme)
-    print("\n")
-
-    # STEP 1: Layer-Uniform quantization of weights and activations
-    print("STEP 1")
-
-    def step1_quantization_test(quantization_bits):
-        """ Function to test the model at STEP 1 of the algorithm
-
-            The function receives a single "quantization_bits" value N, and creates two lists [N, N, ..., N] and
-            [N, N, ..., N] for the activations and the dynamic routing, since at STEP 1 all the layers are quantized
-            uniformly. The weights of each layer are quantized with N bits too and then the accuracy of the model
-            is computed.
-
-            Args:
-                quantization_bits: single value used for quantizing all the weights and activations
-            Returns:
-                acc_temp: accuracy of the model quantized uniformly with quantization_bits bits
-        """
-        quantized_model_temp = copy.deepcopy(model_quant_original)
-
-        step1_act_bits_f = []     # list with the quantization bits for the activations
-        step1_dr_bits_f = []      # list with the quantization bits for the dynamic routing
-        for c in quantized_model_temp.children():
-            step1_act_bits_f.append(quantization_bits)
-            if c.capsule_layer:
-                if c.dynamic_routing:
-                    step1_dr_bits_f.append(quantization_bits)
-            for p in c.parameters():
-                with torch.no_grad():
-                    quantization_function_weights(p, quantization_bits)      # Quantize the weights
-        # test with quantized weights and activations
-        acc_temp = quantized_test(quantized_model_temp, num_classes, data_loader,
-                                  quantization_function_activations, step1_act_bits_f, step1_dr_bits_f)
-        del quantized_model_temp
-        return acc_temp
-
-    # BINARY SEARCH of the bitwidth for step 1, starting from 32 bits
-    step1_bit_search = [32]
-    step1_acc_list = []      # list of accuracy at each step of the search algorithm
-    step1_acc = step1_quantization_test(32)
-    step1_acc_list.append(step1_acc)
-    if step1_acc > step1_min_acc:
-        step1_bit_search_sat = [True]    # True is the accuracy is higher than the minimum required
-        step1_bit_search.append(16)
-        while True:
-            step1_acc = step1_quantization_test(step1_bit_search[-1])
-            step1_acc_list.append(step1_acc)
-            if step1_acc > step1_min_acc:
-                step1_bit_search_sat.append(True)
-            else:
-                step1_bit_search_sat.append(False)
-            if (abs(step1_bit_search[-1] - step1_bit_search[-2])) == 1:
-                step1_bit_search_sat.reverse()
-                step1_bits = step1_bit_search[
-                    len(step1_bit_search_sat) - 1 - next(k for k, val in enumerate(step1_bit_search_sat) if val)]
-                step1_bit_search_sat.reverse()
-                step1_acc = step1_acc_list[
-                    len(step1_bit_search_sat) - 1 - next(k for k, val in enumerate(step1_bit_search_sat) if val)]
-                break
-            else:
-                if step1_acc > step1_min_acc:
-                    step1_bit_search.append(
-                        int(step1_bit_search[-1] - abs(step1_bit_search[-1] - step1_bit_search[-2]) / 2))
-                else:
-                    step1_bit_search.append(
-                        int(step1_bit_search[-1] + abs(step1_bit_search[-1] - step1_bit_search[-2]) / 2))
-    else:
-        step1_bits = 32
-        step1_acc = step1_acc_list[1]
-
-    # Create the lists of bits ofSTEP 1
-    step1_act_bits = []
-    step1_dr_bits = []
-    step1_weight_bits = []
-    for c in model_quant_original.children():
-        step1_act_bits.append(step1_bits)
-        step1_weight_bits.append(step1_bits)
-        if c.capsule_layer:
-            if c.dynamic_routing:
-                step1_dr_bits.append(step1_bits)
-
-    print("STEP 1 output: ")
-    print("\t Weight bits: \t\t", step1_weight_bits)
-    print("\t Activation bits: \t\t", step1_act_bits)
-    print("\t Dynamic Routing bits: \t\t", step1_dr_bits)
-    print("STEP 1 accuracy: ", step1_acc)
-    print("\n")
-
-    # STEP2 - satisfy memory requirement
-    # compute the number of weights and biases of each layer/block
-    print("STEP 2")
-    number_of_weights_inlayers = []
-    for c in model_quant_original.children():
-        param_intra_layer = 0
-        for p in c.parameters():
-            param_intra_layer = param_intra_layer + p.numel()
-        number_of_weights_inlayers.append(param_intra_layer)
-    number_of_blocks = len(number_of_weights_inlayers)
-
-    memory_budget_bits = memory_budget * 8000000      # From MB to bits
-    minimum_mem_required = np.sum(number_of_weights_inlayers)
-
-    if memory_budget_bits < minimum_mem_required:
-        raise ValueError("The memory budget can not be satisfied, increase it to",
-                         minimum_mem_required / 8000000, " MB at least")
-
-    # Compute the number of bits that satisfy the memory budget.
-    # First try with [N, N-1, N-2, N-3, N-4, N-4, ...].
-    # If it is not possible, try with [N, N-1, N-2, N-3, N-3, ...]
-    # and so on until [N, N, N, N, ...] (number of bits uniform across the layers)
-    decrease_amount = 5
-    while decrease_amount >= 0:
-        bit_decrease = []
-        if number_of_blocks <= decrease_amount:
-            i = 0
-            for r in range(0, number_of_blocks):
-                bit_decrease.append(i)
-                i = i - 1
-        else:
-            i = 0
-            for r in range(0, decrease_amount):
-                bit_decrease.append(i)
-                i = i - 1
-            for r in range(decrease_amount, number_of_blocks):
-                bit_decrease.append(i + 1)
-
-        bits_memory_sat = 33
-        while True:
-            # decrease N (bits_memory_sat) until the memory budget is satisfied.
-            bits_memory_sat = bits_memory_sat - 1
-            memory_occupied = np.sum(np.multiply(number_of_weights_inlayers, np.add(bits_memory_sat + 1, bit_decrease)))
-            # +1 because bits_memory_sat are the fractional part bits, but we need one for the integer part
-            if memory_occupied <= memory_budget_bits:
-                break
-
-        step2_weight_bits = list(np.add(bits_memory_sat, bit_decrease))
-        if step2_weight_bits[-1] >= 0:
-            break
-        else:
-            decrease_amount = decrease_amount - 1
-
-    # lists of bitwidths for activations and dynamic routing at STEP 1
-    step2_act_bits = copy.deepcopy(step1_act_bits)
-    step2_dr_bits = copy.deepcopy(step1_dr_bits)
-
-    # Quantizeed the weights
-    model_memory = copy.deepcopy(model_quant_original)
-    for i, c in enumerate(model_memory.children()):
-        for p in c.parameters():
-            with torch.no_grad():
-                quantization_function_weights(p, step2_weight_bits[i])
-    step2_acc = quantized_test(model_memory, num_classes, data_loader,
-                               quantization_function_activations, step2_act_bits, step2_dr_bits)
-
-    print("STEP 2 output: ")
-    print("\t Weight bits: \t\t", step2_weight_bits)
-    print("\t Activation bits: \t\t", step2_act_bits)
-    print("\t Dynamic Routing bits: \t\t", step2_dr_bits)
-    print("STEP 2 accuracy: ", step2_acc)
-    print("\n")
-
-    # IF the step 2 accuracy is higher that the minimum required accuracy --> BRANCH A
-    if step2_acc > minimum_accuracy:
-        # What is the accuracy that can still be consumed?
-        branchA_accuracy_budget = step2_acc - minimum_accuracy
-        step3A_min_acc = step2_acc - branchA_accuracy_budget * 55 / 100
-
-        # STEP 3A  - layer-wise quantization of activations
-        print("STEP 3A")
-        # get the position of the layers that use dynamic routing bits
-        dynamic_routing_bits_bool = []
-        for c in model_memory.children():
-            if c.capsule_layer:
-                if c.dynamic_routing:
-                    dynamic_routing_bits_bool.append(True)
-            else:
-                dynamic_routing_bits_bool.append(False)
-        layers_dr_position = [pos for pos, val in enumerate(dynamic_routing_bits_bool) if val]
-
-        step3a_weight_bits = copy.deepcopy(step2_weight_bits)
-        step3a_act_bits = copy.deepcopy(step2_act_bits)
-        step3a_dr_bits = copy.deepcopy(step2_dr_bits)
-        for l in range(0, len(step3a_act_bits)):
-            while True:
-                step3a_acc = quantized_test(model_memory, num_classes, data_loader,
-                                            quantization_function_activations, step3a_act_bits, step3a_dr_bits)
-                if step3a_acc >= step3A_min_acc:
-                    step3a_act_bits[l:] = list(np.add(step3a_act_bits[l:], -1))
-                    for x in range(len(layers_dr_position)):
-                        step3a_dr_bits[x] = step3a_act_bits[layers_dr_position[x]]
-                else:
-                    step3a_act_bits[l:] = list(np.add(step3a_act_bits[l:], +1))
-                    for x in range(len(layers_dr_position)):
-                        step3a_dr_bits[x] = step3a_act_bits[layers_dr_position[x]]
-                    break
-
-        step3a_acc = quantized_test(model_memory, num_classes, data_loader,
-                                    quantization_function_activations, step3a_act_bits, step3a_dr_bits)
-
-        print("STEP 3A output: ")
-        print("\t Weight bits: \t\t", step3a_weight_bits)
-        print("\t Activation bits: \t\t", step3a_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step3a_dr_bits)
-        print("STEP 3A accuracy: ", step3a_acc)
-        print("\n")
-
-        # STEP 4A  -  layer-wise quantization of dynamic routing
-        print("STEP 4A")
-        step4a_weight_bits = copy.deepcopy(step2_weight_bits)
-        step4a_act_bits = copy.deepcopy(step3a_act_bits)
-        step4a_dr_bits = copy.deepcopy(step3a_dr_bits)
-
-        # need to variate only the bits of the layers in which the dynamic routing is actually performed
-        # (iterations > 1)
-        dynamic_routing_quantization = []
-        for c in model_memory.children():
-            if c.capsule_layer:
-                if c.dynamic_routing:
-                    if c.dynamic_routing_quantization:
-                        dynamic_routing_quantization.append(True)
-                    else:
-                        dynamic_routing_quantization.append(False)
-        dr_quantization_pos = [pos for pos, val in enumerate(dynamic_routing_quantization) if val]
-
-        # new set of bits only if dynamic routing is performed
-        dr_quantization_bits = [step4a_dr_bits[x] for x in dr_quantization_pos]
-        for l in range(0, len(dr_quantization_bits)):
-            while True:
-                step4a_acc = quantized_test(model_memory, num_classes, data_loader,
-                                            quantization_function_activations, step4a_act_bits, step4a_dr_bits)
-                if step4a_acc >= minimum_accuracy:
-                    dr_quantization_bits[l:] = list(np.add(dr_quantization_bits[l:], -1))
-                    # update the whole vector step4a_dr_bits
-                    for x in range(0, len(dr_quantization_bits)):
-                        step4a_dr_bits[dr_quantization_pos[x]] = dr_quantization_bits[x]
-                else:
-                    dr_quantization_bits[l:] = list(np.add(dr_quantization_bits[l:], +1))
-                    # update the whole vector step4a_dr_bits
-                    for x in range(0, len(dr_quantization_bits)):
-                        step4a_dr_bits[dr_quantization_pos[x]] = dr_quantization_bits[x]
-                    break
-
-        step4a_acc = quantized_test(model_memory, num_classes, data_loader,
-                                    quantization_function_activations, step4a_act_bits, step4a_dr_bits)
-
-        print("STEP 4A output: ")
-        print("\t Weight bits: \t\t", step4a_weight_bits)
-        print("\t Activation bits: \t\t", step4a_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step4a_dr_bits)
-        print("STEP 4A accuracy: ", step4a_acc)
-        print("\n")
-
-        print("\n")
-        quantized_filename = full_precision_filename[:-3] + '_quantized_satisfied.pt'
-        torch.save(model_memory.state_dict(), quantized_filename)
-        print("Model-satisfied stored in ", quantized_filename)
-        print("\t Weight bits: \t\t", step4a_weight_bits)
-        print("\t Activation bits: \t\t", step4a_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step4a_dr_bits)
-        print("Model-satisfied accuracy: ", step4a_acc)
-
-    else:
-        # BRANCH B - STEP 3B  - layer-wise quantization of the weights
-        print("STEP 3B")
-        step3b_weight_bits = copy.deepcopy(step1_weight_bits)
-        step3b_act_bits = copy.deepcopy(step1_act_bits)
-        step3b_dr_bits = copy.deepcopy(step1_dr_bits)
-
-        model_accuracy = copy.deepcopy(model_quant_original)
-        for i, c in enumerate(model_accuracy.children()):
-            for p in c.parameters():
-                with torch.no_grad():
-                    quantization_function_weights(p, step3b_weight_bits[i])
-
-        for l in range(0, len(step3b_weight_bits)):
-            while True:
-                step3b_acc = quantized_test(model_accuracy, num_classes, data_loader,
-                                            quantization_function_activations, step3b_act_bits, step3b_dr_bits)
-                if step3b_acc >= minimum_accuracy:
-                    step3b_weight_bits[l:] = list(np.add(step3b_weight_bits[l:], -1))
-                    model_accuracy = copy.deepcopy(model_quant_original)
-                    for i, c in enumerate(model_accuracy.children()):
-                        for p in c.parameters():
-                            with torch.no_grad():
-                                quantization_function_weights(p, step3b_weight_bits[i])
-                else:
-                    step3b_weight_bits[l:] = list(np.add(step3b_weight_bits[l:], +1))
-                    model_accuracy = copy.deepcopy(model_quant_original)
-                    for i, c in enumerate(model_accuracy.children()):
-                        for p in c.parameters():
-                            with torch.no_grad():
-                                quantization_function_weights(p, step3b_weight_bits[i])
-                    break
-
-        step3b_acc = quantized_test(model_accuracy, num_classes, data_loader,
-                                    quantization_function_activations, step3b_act_bits, step3b_dr_bits)
-
-        print("STEP 3B output: ")
-        print("\t Weight bits: \t\t", step3b_weight_bits)
-        print("\t Activation bits: \t\t", step3b_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step3b_dr_bits)
-        print("STEP 3B accuracy: ", step3b_acc)
-        print("\n")
-
-        print("\n")
-        quantized_filename = full_precision_filename[:-3] + '_quantized_memory.pt'
-        torch.save(model_memory.state_dict(), quantized_filename)
-        print("Model-memory stored in ", quantized_filename)
-        print("\t Weight bits: \t\t", step2_weight_bits)
-        print("\t Activation bits: \t\t", step2_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step2_dr_bits)
-        print("Model_memory accuracy: ", step2_acc)
-        print("\n")
-        quantized_filename = full_precision_filename[:-3] + '_quantized_accuracy.pt'
-        torch.save(model_accuracy.state_dict(), quantized_filename)
-        print("Model-memory stored in ", quantized_filename)
-        print("\t Weight bits: \t\t", step3b_weight_bits)
-        print("\t Activation bits: \t\t", step3b_act_bits)
-        print("\t Dynamic Routing bits: \t\t", step3b_dr_bits)
-        print("Model_accuracy accuracy: ", step3b_acc)
+import torch
+import copy
+import sys
+import numpy as np
+from torch.backends import cudnn
+from quantization_methods import *
+from quantized_models import *
+
+
+def quantized_test(model, num_classes, data_loader, quantization_function, quantization_bits,
+                   quantization_bits_routing, early_exit_threshold=None):
+    """ Function to test the accuracy of the quantized models
+
+        Args:
+            model: pytorch model
+            num_classes: number ot classes of the dataset
+            data_loader: data loader of the test dataset
+            quantization_function: quantization function of the quantization method to use
+            quantization_bits: list, quantization bits for the activations
+            quantization_bits_routing: list, quantization bits for the dynamic routing
+            early_exit_threshold: accuracy (percentage) required by the caller, or None. When even
+                                  a perfect score on the remaining batches could not reach the
+                                  threshold, the test stops early: the search loops only need to
+                                  know that the configuration fails, not by how much
+        Returns:
+            accuracy_percentage: accuracy of the quantized model expressed in percentage """
+    # Switch to evaluate mode
+    model.eval()
+
+    if torch.cuda.device_count() > 0:  # if there are available GPUs, move data to the first visible
+        device = torch.device("cuda:0")
+    else:
+        device = torch.device("cpu")
+
+    # the correct predictions are accumulated on the device and transferred back only once at
+    # the end, so no device-to-host synchronization happens inside the loop
+    correct = torch.zeros((), dtype=torch.long, device=device)
+
+    num_test_data = len(data_loader.dataset)
+    seen_data = 0
+
+    # no gradients are needed during the evaluation. The forward pass stays in FP32: the
+    # fixed-point quantizers scale the activations by 2 ** N, which overflows FP16 for the
+    # large fractional bitwidths probed at the beginning of the search
+    with torch.inference_mode():
+        for data, target in data_loader:
+            if device.type == 'cuda':
+                # the loaders use pinned host memory, so the copies are asynchronous and overlap
+                # with the compute of the previous batch
+                data = data.to(device, non_blocking=True)
+                target = target.to(device, non_blocking=True)
+
+            # Output predictions
+            output = model(data, quantization_function, quantization_bits, quantization_bits_routing)
+
+            # Count number of correct predictions
+            # Compute the norm of the vector capsules with a single fused reduction
+            v_length = torch.linalg.vector_norm(output, dim=2)
+
+            # Find the index of the longest vector
+            _, max_index = v_length.max(dim=1)
+
+            # count the samples on which the model makes a correct prediction
+            correct += torch.eq(target, max_index).sum()
+            seen_data += data.size(0)
+
+            if early_exit_threshold is not None:
+                # best accuracy still reachable if all the remaining samples were predicted
+                # correctly. The synchronization of correct.item() only happens when the early
+                # exit is requested
+                best_case_accuracy = (correct.item() + num_test_data - seen_data) * 100.0 / num_test_data
+                if best_case_accuracy < early_exit_threshold:
+                    break
+
+    # Log test accuracies
+    accuracy_percentage = float(correct.item()) * 100.0 / float(num_test_data)
+
+    return accuracy_percentage
+
+
+def quantized_test_multi(model, num_classes, data_loader, quantization_function, configurations):
+    """ Test several activation/dynamic routing configurations in a single pass over the data
+
+        The weights of the model are fixed, so the K configurations share the data loading and
+        the host-to-device copies of every batch; only the forward pass is repeated once per
+        configuration.
+
+        Args:
+            model: pytorch model
+            num_classes: number ot classes of the dataset
+            data_loader: data loader of the test dataset
+            quantization_function: quantization function of the quantization method to use
+            configurations: list of (quantization_bits, quantization_bits_routing) pairs
+        Returns:
+            accuracy_percentages: list with the accuracy of each configuration in percentage """
+    # Switch to evaluate mode
+    model.eval()
+
+    if torch.cuda.device_count() > 0:  # if there are available GPUs, move data to the first visible
+        device = torch.device("cuda:0")
+    else:
+        device = torch.device("cpu")
+
+    # one on-device counter per configuration, transferred back once at the end
+    correct = torch.zeros(len(configurations), dtype=torch.long, device=device)
+
+    # FP32 forward, as in quantized_test: FP16 would overflow the fixed-point quantizers
+    with torch.inference_mode():
+        for data, target in data_loader:
+            if device.type == 'cuda':
+                data = data.to(device, non_blocking=True)
+                target = target.to(device, non_blocking=True)
+
+            for k, (quantization_bits, quantization_bits_routing) in enumerate(configurations):
+                output = model(data, quantization_function, quantization_bits, quantization_bits_routing)
+                v_length = torch.linalg.vector_norm(output, dim=2)
+                _, max_index = v_length.max(dim=1)
+                correct[k] += torch.eq(target, max_index).sum()
+
+    num_test_data = len(data_loader.dataset)
+    return [c * 100.0 / num_test_data for c in correct.cpu().tolist()]
+
+
+def qcapsnets(model, model_parameters, full_precision_filename, num_classes, data_loader, top_accuracy,
+              accuracy_tolerance, memory_budget, quantization_scheme):
+    """ Q-CapsNets framework - Quantization
+
+        Args:
+            model: string, name of the model
+            model_parameters: list, parameters to use for the instantiation of the model class
+            full_precision_filename: string, directory of the full-precision weights
+            num_classes: number of classes of the dataset
+            data_loader: data loader of the testing dataset
+            top_accuracy : maximum accuracy reached by the full_precision trained model (percentage)
+            accuracy_tolerance: tolerance of the quantized model accuracy with respect to the full precision accuracy.
+                                Provided in percentage
+            memory_budget: memory budget for the weights of the model. Provided in MB (MegaBytes)
+            quantization_scheme: quantization scheme to be used by the framework (string, e.g., "truncation)"
+        Returns:
+            void
+    """
+    print("==> Q-CapsNets Framework")
+    # instantiate the quantized model with the full-precision weights
+    model_quant_class = getattr(sys.modules[__name__], model)
+    model_quant_original = model_quant_class(*model_parameters)
+
+    # Move the model to GPU if available
+    if torch.cuda.device_count() > 0:
+        device = torch.device("cuda:0")
+        model_quant_original.to(device)
+        cudnn.benchmark = True
+    else:
+        device = torch.device("cpu")
+
+    # load the full-precision weights directly on the target device, skipping the CPU staging copy
+    model_quant_original.load_state_dict(torch.load(full_precision_filename, map_location=device))
+
+    # Compile the forward once for the whole search: the weight quantization mutates the
+    # parameter storages in place, so the compiled graph stays valid across the trials.
+    # The eager module keeps being used for walking the children and saving the checkpoints,
+    # so the stored state dicts keep their plain key names. fullgraph=False lets the
+    # Python-level quantization functions fall back gracefully
+    compiled_model = model_quant_original
+    if hasattr(torch, 'compile'):
+        compiled_model = torch.compile(model_quant_original, mode="reduce-overhead", fullgraph=False)
+
+    def run_forward_model(run_model):
+        """ Route the evaluation of the persistent model through its compiled wrapper
+
+            Args:
+                run_model: pytorch model selected by the search step
+            Returns:
+                run_model: model to use for the forward passes """
+        return compiled_model if run_model is model_quant_original else run_model
+
+    # create the quantization functions
+    possible_functions = globals().copy()
+    possible_functions.update(locals())
+    quantization_function_activations = possible_functions.get(quantization_scheme)
+    if not quantization_function_activations:
+        raise NotImplementedError("Quantization function %s not implemented" % quantization_scheme)
+    quantization_function_weights = possible_functions.get(quantization_scheme + "_inplace")
+    if not quantization_function_weights:
+        raise NotImplementedError("Quantization function %s not implemented (inplace version)" % quantization_scheme)
+    # optional multi-tensor fast path that quantizes all the parameters of a layer in one go
+    quantization_function_weights_list = possible_functions.get(quantization_scheme + "_inplace_list")
+
+    # The module graph never changes during the search, only the parameter data does, so the
+    # layers/blocks and their parameter lists are walked once and cached here instead of
+    # re-traversing the model at every step
+    children_list = list(model_quant_original.children())
+    params_per_layer = [list(c.parameters()) for c in children_list]
+
+    # Full-precision snapshot of the parameters of each layer/block. The search loops restore
+    # the parameters from the snapshot and re-quantize them in place, instead of deep-copying
+    # the whole model at every trial
+    fp32_snapshot = [[p.detach().clone() for p in params] for params in params_per_layer]
+
+    # weight bits currently applied to the model, used as part of the memoization key
+    applied_weight_bits = [None]
+
+    def quantize_weights(quantization_bits):
+        """ Restore the full-precision weights and quantize them layer by layer
+
+            The search loops usually change the bitwidth of a tail of the network only, so the
+            layers whose requested bits match the ones already applied are left untouched
+            instead of being restored and re-quantized to the same values.
+
+            Args:
+                quantization_bits: list with the quantization bits of each layer/block """
+        previous_bits = applied_weight_bits[0]
+        with torch.no_grad():
+            for i, params in enumerate(params_per_layer):
+                if previous_bits is not None and previous_bits[i] == int(quantization_bits[i]):
+                    continue
+                for p, p_full in zip(params, fp32_snapshot[i]):
+                    p.copy_(p_full)
+                if quantization_function_weights_list is not None:
+                    # quantize all the parameters of the layer with fused multi-tensor kernels
+                    quantization_function_weights_list(params, quantization_bits[i])
+                else:
+                    for p in params:
+                        quantization_function_weights(p, quantization_bits[i])
+        applied_weight_bits[0] = tuple(int(b) for b in quantization_bits)
+
+    # Memoization of the accuracy tests: the search loops overshoot by one bit and step back, so
+    # the same (weights, activations, dynamic routing) configuration is often evaluated twice
+    eval_cache = {}
+
+    def cached_quantized_test(run_model, act_bits, dr_bits, early_exit_threshold=None):
+        """ quantized_test wrapper that memoizes the accuracy of each configuration
+
+            A result obtained with an early exit is only the proof that the configuration fails
+            its threshold, so it is reused for pass/fail checks but never reported as exact.
+
+            Args:
+                run_model: pytorch model to test
+                act_bits: list, quantization bits for the activations
+                dr_bits: list, quantization bits for the dynamic routing
+                early_exit_threshold: see quantized_test
+            Returns:
+                accuracy_percentage: accuracy of the configuration expressed in percentage """
+        # plain-int lists: the np.int64 scalars produced by np.add at the call sites trip the
+        # guards of the compiled forward
+        act_bits = [int(b) for b in act_bits]
+        dr_bits = [int(b) for b in dr_bits]
+        key = (applied_weight_bits[0], tuple(act_bits), tuple(dr_bits))
+        cached = eval_cache.get(key)
+        if cached is not None:
+            accuracy_value, exact = cached
+            if exact or (early_exit_threshold is not None and accuracy_value < early_exit_threshold):
+                return accuracy_value
+        accuracy_value = quantized_test(run_forward_model(run_model), num_classes, data_loader,
+                                        quantization_function_activations, act_bits, dr_bits,
+                                        early_exit_threshold=early_exit_threshold)
+        exact = early_exit_threshold is None or accuracy_value >= early_exit_threshold
+        if cached is None or exact:
+            eval_cache[key] = (accuracy_value, exact)
+        return accuracy_value
+
+    def sweep_configurations(run_model, configurations):
+        """ Evaluate several activation/dynamic routing configurations in one pass over the data
+
+            The exact accuracies are also stored in the memoization cache, so the reporting
+            test of the selected configuration comes for free.
+
+            Args:
+                run_model: pytorch model to test
+                configurations: list of (act_bits, dr_bits) pairs
+            Returns:
+                accuracies: list with the accuracy of each configuration in percentage """
+        # plain-int lists, as in cached_quantized_test, for the compiled forward
+        configurations = [([int(b) for b in act_bits], [int(b) for b in dr_bits])
+                          for act_bits, dr_bits in configurations]
+        accuracies = quantized_test_multi(run_forward_model(run_model), num_classes, data_loader,
+                                          quantization_function_activations, configurations)
+        for (act_bits, dr_bits), accuracy_value in zip(configurations, accuracies):
+            key = (applied_weight_bits[0], tuple(act_bits), tuple(dr_bits))
+            eval_cache[key] = (accuracy_value, True)
+        return accuracies
+
+    def count_leading_passing(run_model, candidates, threshold, chunk_size=4):
+        """ Count the leading candidates that satisfy an accuracy threshold
+
+            The descent only consumes the run of passing candidates at the head of the list, so
+            the candidates are evaluated in small shared-pass chunks of increasing reduction and
+            the evaluation stops at the first failing one, as the one-bit-at-a-time descent did.
+
+            Args:
+                run_model: pytorch model to test
+                candidates: list of (act_bits, dr_bits) pairs, ordered by increasing reduction
+                threshold: minimum accuracy (percentage) a candidate has to reach
+                chunk_size: number of candidates whose evaluation shares one data pass
+            Returns:
+                passing: number of leading candidates whose accuracy reaches the threshold """
+        passing = 0
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            accuracies = sweep_configurations(run_model, chunk)
+            chunk_passing = 0
+            for accuracy_value in accuracies:
+                if accuracy_value >= threshold:
+                    chunk_passing += 1
+                else:
+                    break
+            passing += chunk_passing
+            if chunk_passing < len(chunk):
+                break
+        return passing
+
+    # compute the accuracy reduction available for each step
+    minimum_accuracy = top_accuracy - accuracy_tolerance / 100 * top_accuracy
+    acc_reduction = top_accuracy - minimum_accuracy
+    step1_reduction = 5 / 100 * acc_reduction
+    step1_min_acc = top_accuracy - step1_reduction
+
+    print("Full-precision accuracy: ", top_accuracy, "%")
+    print("Minimum quantized accuracy: ", minimum_accuracy, "%")
+    print("Memory budget: ", memory_budget, "MB")
+    print("Quantization method: ", quantization_scheme)
+    print("\n")
+
+    # STEP 1: Layer-Uniform quantization of weights and activations
+    print("STEP 1")
+
+    def step1_quantization_test(quantization_bits):
+        """ Function to test the model at STEP 1 of the algorithm
+
+            The function receives a single "quantization_bits" value N, and creates two lists [N, N, ..., N] and
+            [N, N, ..., N] for the activations and the dynamic routing, since at STEP 1 all the layers are quantized
+            uniformly. The weights of each layer are quantized with N bits too and then the accuracy of the model
+            is computed.
+
+            Args:
+                quantization_bits: single value used for quantizing all the weights and activations
+            Returns:
+                acc_temp: accuracy of the model quantized uniformly with quantization_bits bits
+        """
+        step1_act_bits_f = []     # list with the quantization bits for the activations
+        step1_dr_bits_f = []      # list with the quantization bits for the dynamic routing
+        for c in children_list:
+            step1_act_bits_f.append(quantization_bits)
+            if c.capsule_layer:
+                if c.dynamic_routing:
+                    step1_dr_bits_f.append(quantization_bits)
+        quantize_weights([quantization_bits] * len(step1_act_bits_f))    # Quantize the weights
+        # test with quantized weights and activations
+        acc_temp = cached_quantized_test(model_quant_original, step1_act_bits_f, step1_dr_bits_f,
+                                         early_exit_threshold=step1_min_acc)
+        return acc_temp
+
+    # BINARY SEARCH of the bitwidth for step 1, starting from 32 bits
+    step1_bit_search = [32]
+    step1_acc_list = []      # list of accuracy at each step of the search algorithm
+    step1_acc = step1_quantization_test(32)
+    step1_acc_list.append(step1_acc)
+    if step1_acc > step1_min_acc:
+        step1_bit_search_sat = [True]    # True is the accuracy is higher than the minimum required
+        step1_bit_search.append(16)
+        while True:
+            step1_acc = step1_quantization_test(step1_bit_search[-1])
+            step1_acc_list.append(step1_acc)
+            if step1_acc > step1_min_acc:
+                step1_bit_search_sat.append(True)
+            else:
+                step1_bit_search_sat.append(False)
+            if (abs(step1_bit_search[-1] - step1_bit_search[-2])) == 1:
+                step1_bit_search_sat.reverse()
+                step1_bits = step1_bit_search[
+                    len(step1_bit_search_sat) - 1 - next(k for k, val in enumerate(step1_bit_search_sat) if val)]
+                step1_bit_search_sat.reverse()
+                step1_acc = step1_acc_list[
+                    len(step1_bit_search_sat) - 1 - next(k for k, val in enumerate(step1_bit_search_sat) if val)]
+                break
+            else:
+                if step1_acc > step1_min_acc:
+                    step1_bit_search.append(
+                        int(step1_bit_search[-1] - abs(step1_bit_search[-1] - step1_bit_search[-2]) / 2))
+                else:
+                    step1_bit_search.append(
+                        int(step1_bit_search[-1] + abs(step1_bit_search[-1] - step1_bit_search[-2]) / 2))
+    else:
+        step1_bits = 32
+        step1_acc = step1_acc_list[1]
+
+    # Create the lists of bits ofSTEP 1
+    step1_act_bits = []
+    step1_dr_bits = []
+    step1_weight_bits = []
+    for c in children_list:
+        step1_act_bits.append(step1_bits)
+        step1_weight_bits.append(step1_bits)
+        if c.capsule_layer:
+            if c.dynamic_routing:
+                step1_dr_bits.append(step1_bits)
+
+    print("STEP 1 output: ")
+    print("\t Weight bits: \t\t", step1_weight_bits)
+    print("\t Activation bits: \t\t", step1_act_bits)
+    print("\t Dynamic Routing bits: \t\t", step1_dr_bits)
+    print("STEP 1 accuracy: ", step1_acc)
+    print("\n")
+
+    # STEP2 - satisfy memory requirement
+    # compute the number of weights and biases of each layer/block
+    print("STEP 2")
+    # int64 array so that the memory accounting of the search is a single dot product. The
+    # parameter lists cached above are reused instead of traversing the model again
+    number_of_weights_inlayers = np.asarray(
+        [sum(p.numel() for p in params) for params in params_per_layer], dtype=np.int64)
+    number_of_blocks = len(number_of_weights_inlayers)
+
+    memory_budget_bits = memory_budget * 8000000      # From MB to bits
+    minimum_mem_required = number_of_weights_inlayers.sum()
+
+    if memory_budget_bits < minimum_mem_required:
+        raise ValueError("The memory budget can not be satisfied, increase it to",
+                         minimum_mem_required / 8000000, " MB at least")
+
+    # Compute the number of bits that satisfy the memory budget.
+    # First try with [N, N-1, N-2, N-3, N-4, N-4, ...].
+    # If it is not possible, try with [N, N-1, N-2, N-3, N-3, ...]
+    # and so on until [N, N, N, N, ...] (number of bits uniform across the layers)
+    decrease_amount = 5
+    while decrease_amount >= 0:
+        # descending profile [0, -1, ..., -(decrease_amount - 1)] clamped at the last value for
+        # the remaining layers, built in one vectorized expression
+        bit_decrease = -np.minimum(np.arange(number_of_blocks), decrease_amount - 1)
+
+        # largest N (bits_memory_sat) that satisfies the memory budget, in closed form:
+        # the occupied memory is dot(weights, bit_decrease) + (N + 1) * total_weights, where the
+        # +1 accounts for the integer-part bit on top of the N fractional bits. The search
+        # starts from 32 bits, so the result is capped there
+        total_number_of_weights = number_of_weights_inlayers.sum()
+        profile_memory = np.dot(number_of_weights_inlayers, bit_decrease)
+        bits_memory_sat = min(32, int((memory_budget_bits - profile_memory - total_number_of_weights)
+                                      // total_number_of_weights))
+
+        step2_weight_bits = list(np.add(bits_memory_sat, bit_decrease))
+        if step2_weight_bits[-1] >= 0:
+            break
+        else:
+            decrease_amount = decrease_amount - 1
+
+    # lists of bitwidths for activations and dynamic routing at STEP 1
+    step2_act_bits = copy.deepcopy(step1_act_bits)
+    step2_dr_bits = copy.deepcopy(step1_dr_bits)
+
+    # Quantize the weights
+    quantize_weights(step2_weight_bits)
+    model_memory = model_quant_original
+    step2_acc = cached_quantized_test(model_memory, step2_act_bits, step2_dr_bits)
+
+    print("STEP 2 output: ")
+    print("\t Weight bits: \t\t", step2_weight_bits)
+    print("\t Activation bits: \t\t", step2_act_bits)
+    print("\t Dynamic Routing bits: \t\t", step2_dr_bits)
+    print("STEP 2 accuracy: ", step2_acc)
+    print("\n")
+
+    # IF the step 2 accuracy is higher that the minimum required accuracy --> BRANCH A
+    if step2_acc > minimum_accuracy:
+        # What is the accuracy that can still be consumed?
+        branchA_accuracy_budget = step2_acc - minimum_accuracy
+        step3A_min_acc = step2_acc - branchA_accuracy_budget * 55 / 100
+
+        # STEP 3A  - layer-wise quantization of activations
+        print("STEP 3A")
+        # get the position of the layers that use dynamic routing bits
+        dynamic_routing_bits_bool = []
+        for c in children_list:
+            if c.capsule_layer:
+                if c.dynamic_routing:
+                    dynamic_routing_bits_bool.append(True)
+            else:
+                dynamic_routing_bits_bool.append(False)
+        layers_dr_position = [pos for pos, val in enumerate(dynamic_routing_bits_bool) if val]
+
+        step3a_weight_bits = copy.deepcopy(step2_weight_bits)
+        step3a_act_bits = copy.deepcopy(step2_act_bits)
+        step3a_dr_bits = copy.deepcopy(step2_dr_bits)
+        for l in range(0, len(step3a_act_bits)):
+            # the candidate reductions of the tail [l:] share their passes over the test set
+            # (the weights do not change during STEP 3A) and are evaluated in increasing order,
+            # stopping at the first one that crosses the accuracy threshold
+            candidates = []
+            for reduction in range(0, min(step3a_act_bits[l:]) + 1):
+                cand_act_bits = list(step3a_act_bits)
+                cand_act_bits[l:] = list(np.add(step3a_act_bits[l:], -reduction))
+                cand_dr_bits = list(step3a_dr_bits)
+                for x in range(len(layers_dr_position)):
+                    cand_dr_bits[x] = cand_act_bits[layers_dr_position[x]]
+                candidates.append((cand_act_bits, cand_dr_bits))
+            chosen = count_leading_passing(model_memory, candidates[1:], step3A_min_acc)
+            step3a_act_bits, step3a_dr_bits = candidates[chosen]
+
+        step3a_acc = cached_quantized_test(model_memory, step3a_act_bits, step3a_dr_bits)
+
+        print("STEP 3A output: ")
+        print("\t Weight bits: \t\t", step3a_weight_bits)
+        print("\t Activation bits: \t\t", step3a_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step3a_dr_bits)
+        print("STEP 3A accuracy: ", step3a_acc)
+        print("\n")
+
+        # STEP 4A  -  layer-wise quantization of dynamic routing
+        print("STEP 4A")
+        step4a_weight_bits = copy.deepcopy(step2_weight_bits)
+        step4a_act_bits = copy.deepcopy(step3a_act_bits)
+        step4a_dr_bits = copy.deepcopy(step3a_dr_bits)
+
+        # need to variate only the bits of the layers in which the dynamic routing is actually performed
+        # (iterations > 1)
+        dynamic_routing_quantization = []
+        for c in children_list:
+            if c.capsule_layer:
+                if c.dynamic_routing:
+                    if c.dynamic_routing_quantization:
+                        dynamic_routing_quantization.append(True)
+                    else:
+                        dynamic_routing_quantization.append(False)
+        dr_quantization_pos = [pos for pos, val in enumerate(dynamic_routing_quantization) if val]
+
+        # new set of bits only if dynamic routing is performed
+        dr_quantization_bits = [step4a_dr_bits[x] for x in dr_quantization_pos]
+        for l in range(0, len(dr_quantization_bits)):
+            # single-pass sweep of the candidate reductions of the tail [l:], as in STEP 3A
+            candidates = []
+            for reduction in range(0, min(dr_quantization_bits[l:]) + 1):
+                cand_dr_quantization_bits = list(dr_quantization_bits)
+                cand_dr_quantization_bits[l:] = list(np.add(dr_quantization_bits[l:], -reduction))
+                # update the whole vector step4a_dr_bits
+                cand_dr_bits = list(step4a_dr_bits)
+                for x in range(0, len(cand_dr_quantization_bits)):
+                    cand_dr_bits[dr_quantization_pos[x]] = cand_dr_quantization_bits[x]
+                candidates.append((list(step4a_act_bits), cand_dr_bits))
+            chosen = count_leading_passing(model_memory, candidates[1:], minimum_accuracy)
+            dr_quantization_bits[l:] = list(np.add(dr_quantization_bits[l:], -chosen))
+            for x in range(0, len(dr_quantization_bits)):
+                step4a_dr_bits[dr_quantization_pos[x]] = dr_quantization_bits[x]
+
+        step4a_acc = cached_quantized_test(model_memory, step4a_act_bits, step4a_dr_bits)
+
+        print("STEP 4A output: ")
+        print("\t Weight bits: \t\t", step4a_weight_bits)
+        print("\t Activation bits: \t\t", step4a_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step4a_dr_bits)
+        print("STEP 4A accuracy: ", step4a_acc)
+        print("\n")
+
+        print("\n")
+        quantized_filename = full_precision_filename[:-3] + '_quantized_satisfied.pt'
+        torch.save(model_memory.state_dict(), quantized_filename)
+        print("Model-satisfied stored in ", quantized_filename)
+        print("\t Weight bits: \t\t", step4a_weight_bits)
+        print("\t Activation bits: \t\t", step4a_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step4a_dr_bits)
+        print("Model-satisfied accuracy: ", step4a_acc)
+
+    else:
+        # BRANCH B - STEP 3B  - layer-wise quantization of the weights
+        print("STEP 3B")
+        step3b_weight_bits = copy.deepcopy(step1_weight_bits)
+        step3b_act_bits = copy.deepcopy(step1_act_bits)
+        step3b_dr_bits = copy.deepcopy(step1_dr_bits)
+
+        # keep the state of the model quantized at STEP 2 for the final storage, since the
+        # persistent model is re-quantized in place during the search. Cloning the tensors is
+        # enough (and much cheaper than deep-copying the dictionary through Python)
+        step2_state = {k: v.detach().clone() for k, v in model_memory.state_dict().items()}
+
+        model_accuracy = model_quant_original
+        quantize_weights(step3b_weight_bits)
+
+        for l in range(0, len(step3b_weight_bits)):
+            # BINARY SEARCH of the largest reduction of the tail [l:] that keeps the accuracy
+            # above the minimum. The accuracy decreases monotonically with the reduction, so the
+            # one-bit-at-a-time descent is replaced by O(log) accuracy tests
+            base_tail_bits = list(step3b_weight_bits[l:])
+            passing_reduction = 0
+            failing_reduction = min(base_tail_bits)     # larger reductions would need negative bits
+            while passing_reduction < failing_reduction:
+                candidate_reduction = (passing_reduction + failing_reduction + 1) // 2
+                step3b_weight_bits[l:] = list(np.add(base_tail_bits, -candidate_reduction))
+                quantize_weights(step3b_weight_bits)
+                step3b_acc = cached_quantized_test(model_accuracy, step3b_act_bits, step3b_dr_bits,
+                                                   early_exit_threshold=minimum_accuracy)
+                if step3b_acc >= minimum_accuracy:
+                    passing_reduction = candidate_reduction
+                else:
+                    failing_reduction = candidate_reduction - 1
+            step3b_weight_bits[l:] = list(np.add(base_tail_bits, -passing_reduction))
+            quantize_weights(step3b_weight_bits)
+
+        step3b_acc = cached_quantized_test(model_accuracy, step3b_act_bits, step3b_dr_bits)
+
+        print("STEP 3B output: ")
+        print("\t Weight bits: \t\t", step3b_weight_bits)
+        print("\t Activation bits: \t\t", step3b_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step3b_dr_bits)
+        print("STEP 3B accuracy: ", step3b_acc)
+        print("\n")
+
+        print("\n")
+        quantized_filename = full_precision_filename[:-3] + '_quantized_memory.pt'
+        torch.save(step2_state, quantized_filename)
+        print("Model-memory stored in ", quantized_filename)
+        print("\t Weight bits: \t\t", step2_weight_bits)
+        print("\t Activation bits: \t\t", step2_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step2_dr_bits)
+        print("Model_memory accuracy: ", step2_acc)
+        print("\n")
+        quantized_filename = full_precision_filename[:-3] + '_quantized_accuracy.pt'
+        torch.save(model_accuracy.state_dict(), quantized_filename)
+        print("Model-memory stored in ", quantized_filename)
+        print("\t Weight bits: \t\t", step3b_weight_bits)
+        print("\t Activation bits: \t\t", step3b_act_bits)
+        print("\t Dynamic Routing bits: \t\t", step3b_dr_bits)
+        print("Model_accuracy accuracy: ", step3b_acc)
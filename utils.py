@@ -1,11 +1,5 @@
 import torch
 import torch.nn.functional as F
-from torch.utils.data import DataLoader
-from torch.autograd import Variable
-from torchvision import transforms, datasets
-import torchvision.utils as vutils
-import argparse
-import math
 
 from data_loaders import *
 
@@ -42,8 +36,8 @@ def accuracy(output, target):
     """
     batch_size = target.size(0)
 
-    # Compute the norm of the vector capsules
-    v_length = torch.sqrt((output ** 2).sum(dim=2))
+    # Compute the norm of the vector capsules with a single fused reduction
+    v_length = torch.linalg.vector_norm(output, dim=2)
 
     # Find the index of the longest vector
     _, max_index = v_length.max(dim=1)